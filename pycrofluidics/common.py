@@ -3,9 +3,11 @@ Module containing functions and stuff different implemented devices and methods
 """
 import pycrofluidics
 import sys
-import platformdirs
 import pathlib
-import ruamel.yaml as yaml
+import functools
+import time
+import warnings
+from ctypes import c_int32
 
 ERRORCODES = {
     8000 : 'No Digital Sensor found',
@@ -18,15 +20,51 @@ ERRORCODES = {
     8007 : 'ESI software seems to have connection with Device, close ESI before continuing in Python',
     2 : "Unknown error from stopping remote mode"
 }
+_ERRORCODES_GET = ERRORCODES.get
+# Errorcodes meaning the device itself cannot be reached, as opposed to e.g. one channel that cannot be read
+DEVICE_ERRORCODES = frozenset((8006,8007))
+
+_CONFIG_CACHE: dict[pathlib.Path, tuple[float, dict]] = {}
+_CONFIG_DIR: pathlib.Path | None = None
+_CONFIG_FILE: pathlib.Path | None = None
+_ELVEFLOW_MODULE = None
+
+# ruamel.yaml and platformdirs are slow to import and only needed for config file I/O,
+# so they are imported on first use.
+@functools.cache
+def _yaml():
+    """Return the YAML (de)serializer used for the config file."""
+    import ruamel.yaml as yaml
+    yo = yaml.YAML(typ='safe')
+    # Force block style when writing
+    yo.default_flow_style = False
+    yo.indent(mapping=2, sequence=4, offset=2)
+    return yo
+
+@functools.cache
+def _platformdirs():
+    import platformdirs
+    return platformdirs
+
+def _load_config_cached() -> dict:
+    """
+    Return the parsed config file. The result is cached, and the file is only parsed again when it changed on disk.
+    """
+    config_file = where_is_the_config_file()
+    mtime = config_file.stat().st_mtime
+    cached = _CONFIG_CACHE.get(config_file)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    # Not read before, or file changed on disk since: (re)parse it
+    config = _yaml().load(config_file)
+    _CONFIG_CACHE[config_file] = (mtime, config)
+    return config
 
 def read_config(key:str):
     """
     Read value from config file
     """
-    config_file = where_is_the_config_file()
-    yo = yaml.YAML(typ='safe')
-    config = yo.load(config_file)
-    return config[key]
+    return _load_config_cached()[key]
 
 def write_config(key:str, value:str):
     """
@@ -34,43 +72,99 @@ def write_config(key:str, value:str):
     """
     assert type(key) == type(value) == str, 'Config key and values should always be strings'
     config_file = where_is_the_config_file()
-    yo = yaml.YAML(typ='safe')
-    config = yo.load(config_file)
+    config = dict(_load_config_cached()) # copy, so the cache is not changed if writing fails
     config[key] = value
-    # Force block style
-    yo.default_flow_style = False
-    yo.indent(mapping=2, sequence=4, offset=2)
-    yo.dump(config,config_file)
+    _yaml().dump(config,config_file)
+    # This dict is what we just wrote, so it can go straight into the cache
+    _CONFIG_CACHE[config_file] = (config_file.stat().st_mtime, config)
 
 def add_elveflow_to_path():
     """
     Add Elveflow SDK and DLL to path, based on config file.
     """
-    sys.path.append(read_config("elveflow_dll"))
-    sys.path.append(read_config("elveflow_sdk"))
+    add_to_path(read_config("elveflow_dll"))
+    add_to_path(read_config("elveflow_sdk"))
+
+def load_elveflow(elveflowDLL: str = None, elveflowSDK: str = None):
+    """
+    Import the Elveflow SDK (Elveflow64) once per process and return it. The paths (or the config file, if not given) are only used on the first call.
+    """
+    global _ELVEFLOW_MODULE
+    if _ELVEFLOW_MODULE is None:
+        if elveflowDLL != None or elveflowSDK != None:
+            add_to_path(elveflowDLL)
+            add_to_path(elveflowSDK)
+        else:
+            add_elveflow_to_path()
+        import Elveflow64
+        _ELVEFLOW_MODULE = Elveflow64
+    return _ELVEFLOW_MODULE
+
+def add_to_path(path:str):
+    """
+    Add path to sys.path, unless it is allready there. Every import scans sys.path, so we do not want it to keep growing when devices are created over and over.
+    """
+    if path not in sys.path:
+        sys.path.append(path)
+
+def bind_dll_function(ef, name:str, argtypes:list, restype = c_int32):
+    """
+    Get DLL function `name` with its ctypes prototype set once, so ctypes does not have to work out argument conversion on every call.
+    The Elveflow SDK wraps every DLL function in a Python function that resets the prototype on each call, so I go to the DLL (ef.ElveflowDLL) directly. If that is not available in this SDK version, fall back to the SDK wrapper.
+    """
+    dll = getattr(ef, "ElveflowDLL", None)
+    if dll is None:
+        return getattr(ef, name)
+    function = getattr(dll, name)
+    function.argtypes = argtypes
+    function.restype = restype
+    return function
 
 def raiseEFerror(error:int, action:str = 'Elveflow command'):
     """Raise an error with errorcode, and give the reason if it is known."""
     if error == 0: 
         # This means no error
         return None
-    elif abs(error) in ERRORCODES.keys():
+    reason = _ERRORCODES_GET(abs(error))
+    if reason is not None:
         # Known error
-        raise ConnectionError('{0} failed with errorcode {1} : {2}'.format(action,error,ERRORCODES[abs(error)]))
-    else: 
+        exception = ConnectionError(f"{action} failed with errorcode {error} : {reason}")
+    else:
         # Generic unknown error
-        raise ConnectionError(f"{action} failed with errorcode {error} (not specified further)")
+        exception = ConnectionError(f"{action} failed with errorcode {error} (not specified further)")
+    exception.errno = error # so callers can check the errorcode without reading the message
+    raise exception
+
+def throttledWarn(lastWarn, key, message, interval = 1.0):
+    """
+    warnings.warn, but at most once per interval seconds for each kind of warning (key). lastWarn is a dict in which I remember when each kind was last given.
+    Warning is slow-ish, so a sensor that stays broken would otherwise slow down the loop that is warning about it.
+    message can also be a function returning the message, so it is only put together if the warning is actually given.
+    """
+    t = time.monotonic()
+    if t - lastWarn.get(key, -interval) >= interval:
+        lastWarn[key] = t
+        if callable(message):
+            message = message()
+        warnings.warn(message, stacklevel=2)
 
 def where_is_the_config_dir():
-    config_dir = pathlib.Path( platformdirs.user_config_dir(appname = pycrofluidics.APPNAME, 
+    """Return the directory containing the config file. Created on first call, remembered afterwards."""
+    global _CONFIG_DIR
+    if _CONFIG_DIR is not None:
+        return _CONFIG_DIR
+    config_dir = pathlib.Path( _platformdirs().user_config_dir(appname = pycrofluidics.APPNAME, 
                                                             appauthor = pycrofluidics.APPAUTHOR) )
     config_dir.mkdir(parents=True,exist_ok=True)
+    _CONFIG_DIR = config_dir
     return config_dir
 
 def where_is_the_config_file() -> str:
     """Return the path to the config file, containing default config like device names."""
-    config_dir = where_is_the_config_dir()
-    config_file = config_dir / "config.yaml"
-    if not config_file.exists():
-        config_file.touch()
+    global _CONFIG_FILE
+    if _CONFIG_FILE is not None:
+        return _CONFIG_FILE
+    config_file = where_is_the_config_dir() / "config.yaml"
+    config_file.touch(exist_ok=True) # creates file if missing, no need to check first
+    _CONFIG_FILE = config_file
     return config_file
\ No newline at end of file
@@ -1,6 +1,5 @@
-import sys
 from ctypes import *
-import pathlib
+import os
 import time
 import pycrofluidics.common as common
 
@@ -8,6 +7,7 @@ class MUXelve:
     '''
     Overarching class controlling Elveflow MUX distributor 1/12
     '''
+    ef = None # Elveflow SDK module, set by loadDLL
     def __init__(self, 
                  elveflowDLL: str = None, 
                  elveflowSDK: str = None, 
@@ -35,12 +35,13 @@ class MUXelve:
         if type(deviceName) != str and deviceName != None:
             raise TypeError("deviceName should be supplied as string or left at default")
         if any( [elveflowDLL!=None, elveflowSDK!= None] ):
-            if ( not pathlib.Path(elveflowDLL).exists() ) or ( not pathlib.Path(elveflowSDK).exists() ):
+            if not ( os.path.exists(elveflowDLL) and os.path.exists(elveflowSDK) ):
                 raise FileNotFoundError("I could not find the given paths to the Elveflow DLL and/or Python SDK")
         self.deviceName = deviceName
         self.deviceID = deviceID
         self.ELVEFLOW_DLL = elveflowDLL
         self.ELVEFLOW_SDK = elveflowSDK
+        self._cmd_answer_buf = (c_char*40)() # MUX_DRI_Send_Command needs to be able to give a generic reply, even if it is not used.
         self.loadDLL()
 
     def open(self, 
@@ -65,18 +66,19 @@ class MUXelve:
             else:
                 self.deviceName = common.read_config("mux_name")
         self.Instr_ID = c_int32()
-        error = self.ef.MUX_DRI_Initialization(
+        error = self._MUX_DRI_Initialization(
             self.deviceName.encode('ascii'),
             byref(self.Instr_ID)
         )
         common.raiseEFerror(error,'Initialize connection to MUX distributor')
+        self._instr_id = self.Instr_ID.value # cached, so we do not have to go through the c_int32 for every call
         if verbose:
             print(f"Error code: {error}, Instrument ID: {self.Instr_ID.value}")
         if auto_home:
             self.home()
 
     def close(self):
-        error = self.ef.MUX_DRI_Destructor( self.Instr_ID )
+        error = self._MUX_DRI_Destructor( self._instr_id )
         common.raiseEFerror(error,'Closing connection to MUX distributor')
 
     def home( self, start_channel:int = 1 ):
@@ -88,11 +90,10 @@ class MUXelve:
         autoHome : bool, optional 
             Before usage, device should always be homed. Set to True to do this automatically when object is created. By default True
         """
-        Answer=(c_char*40)() # it needs to be able to give a generic reply, even if it is not used.
-        error = self.ef.MUX_DRI_Send_Command(
-            self.Instr_ID.value,
+        error = self._MUX_DRI_Send_Command(
+            self._instr_id,
             0,
-            Answer,
+            self._cmd_answer_buf, # never read, so can be reused
             40, # length is set to 40 to contain the whole Serial Number, which is a possible answer.
         )
         common.raiseEFerror(error,'Homing MUX distributor')
@@ -122,52 +123,63 @@ class MUXelve:
             raise ValueError("Choose a valve index between 1 and 12")
         if self.get_valve() == valve_index: # am allready there, bye.
             return valve_index
-        valve_index_i32 = c_int32( valve_index ) #convert to c_int32
-        error = self.ef.MUX_DRI_Set_Valve(
-            self.Instr_ID.value,
-            valve_index_i32,
+        error = self._MUX_DRI_Set_Valve(
+            self._instr_id,
+            valve_index, # converted to c_int32 by ctypes
             rotation_direction
         )
-        common.raiseEFerror(error,f'Switching to MUX valve with index {valve_index}')
+        if error: common.raiseEFerror(error,f'Switching to MUX valve with index {valve_index}')
         if blocking:
             self.wait_for_valve_movement()
-        if (self.get_valve() != valve_index ) and (self.get_valve() != 0):
-            raise ConnectionError(f"Failed to set MUX to correct location: set to {valve_index}, but found at {self.get_valve()}")
+        final_valve = self.get_valve()
+        if (final_valve != valve_index ) and (final_valve != 0):
+            raise ConnectionError(f"Failed to set MUX to correct location: set to {valve_index}, but found at {final_valve}")
         return valve_index
 
     def get_valve(self) -> int:
         """
         Get current position of valve. If 0 is returned, valve is currently busy!
         """
-        valve = c_int32( -1 ) # This will contain the valve later
-        error = self.ef.MUX_DRI_Get_Valve(
-            self.Instr_ID.value,
-            byref(valve) # 1-12 for valves, and 0 if busy
+        error = self._MUX_DRI_Get_Valve(
+            self._instr_id,
+            self._valve_out_ref # 1-12 for valves, and 0 if busy
         ) 
-        common.raiseEFerror(error,f'gettting valve position of MUX')
-        return int(valve.value)
+        if error: common.raiseEFerror(error,'gettting valve position of MUX')
+        return int(self._valve_out.value)
 
-    def wait_for_valve_movement(self, timeout: float = 5):
-        '''Block execution while valve is moving. Timeout is in seconds.'''
-        current_valve = 0
+    def wait_for_valve_movement(self, 
+                                timeout: float = 5,
+                                poll_interval: float = 0.005,
+                                max_poll_interval: float = 0.05):
+        '''
+        Block execution while valve is moving. Instead of hammering the DLL, the time between checks grows from poll_interval to max_poll_interval. All times are in seconds.
+        '''
+        delay = poll_interval
         t0 = time.time()
-        while current_valve == 0:
-            current_valve = self.get_valve()
+        while True:
+            if self.get_valve() != 0:
+                return True
             if time.time() - t0 > timeout:
                 raise ConnectionError("Critical hardware error: valve movement has timed out")
-        return True
+            time.sleep(delay)
+            delay = min(delay * 1.5, max_poll_interval)
 
     def loadDLL(self):
         """
-        Load Elveflow DLL and acompanying Python SDK.
+        Load Elveflow DLL and acompanying Python SDK. The DLL functions are bound to the class, so this work is only done once per process.
         """
-        if self.ELVEFLOW_DLL != None or self.ELVEFLOW_SDK != None:
-            sys.path.append(self.ELVEFLOW_DLL)
-            sys.path.append(self.ELVEFLOW_SDK)
-        else:
-            common.add_elveflow_to_path()
-        import Elveflow64 as ef
-        self.ef = ef
+        ef = common.load_elveflow(self.ELVEFLOW_DLL, self.ELVEFLOW_SDK)
+        cls = type(self)
+        if cls.ef is not ef:
+            cls.ef = ef
+            # Set up DLL functions once, with their prototypes, instead of on every call
+            cls._MUX_DRI_Initialization = staticmethod(common.bind_dll_function(ef, "MUX_DRI_Initialization", [c_char_p, POINTER(c_int32)]))
+            cls._MUX_DRI_Destructor = staticmethod(common.bind_dll_function(ef, "MUX_DRI_Destructor", [c_int32]))
+            cls._MUX_DRI_Send_Command = staticmethod(common.bind_dll_function(ef, "MUX_DRI_Send_Command", [c_int32, c_uint16, c_char_p, c_int32]))
+            cls._MUX_DRI_Set_Valve = staticmethod(common.bind_dll_function(ef, "MUX_DRI_Set_Valve", [c_int32, c_int32, c_uint16]))
+            cls._MUX_DRI_Get_Valve = staticmethod(common.bind_dll_function(ef, "MUX_DRI_Get_Valve", [c_int32, POINTER(c_int32)]))
+        self._valve_out = c_int32( -1 ) # get_valve writes the valve position in here
+        self._valve_out_ref = byref(self._valve_out)
 
     def __enter__(self, 
                   auto_home: bool = True,
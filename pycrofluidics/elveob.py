@@ -1,14 +1,23 @@
-import sys
 from ctypes import *
+import os
 import pathlib
 import datetime
+import time
 import json
+import array
+import numpy as np
 import pycrofluidics.common as common
 
+CALIB_LEN = 1000 # Number of values in a pressure callibration
+CALIB_T = c_double*CALIB_LEN # Type of the pressure callibration array the DLL works with
+_CALIB_HEADER = b"PCFCALIB" # Start of binary callibration files, to tell them apart from old json ones
+
 class OB1elve:
     '''
     Overarching class controlling Elveflow OB1-Mk4
     '''
+    ef = None # Elveflow SDK module, set by loadDLL
+    nChannels = 4 # Number of pressure channels (and sensor inputs) on the device
     def __init__( self, 
                  elveflowDLL: str = None, 
                  elveflowSDK: str = None,
@@ -38,22 +47,22 @@ class OB1elve:
         deviceID : int, optional
             If multiple devices are used, this ID can be set to select one of the entries for the deviceName in the config file.
         """
-        if type(deviceName) != str and deviceName != None:
+        if not isinstance(deviceName, str) and deviceName != None:
             raise TypeError("deviceName should be supplied as string or left at default")
-        if type(deviceRegulators) != list:
+        if not isinstance(deviceRegulators, list):
             printRegulatorTypes()
             raise TypeError("Give deviceRegulators as a list of 4 integers, see table above")
         if len(deviceRegulators) != 4:
             printRegulatorTypes()
             raise TypeError("Give deviceRegulators as a list of 4 integers, see table above")
-        if (any([type(i)!=int for i in deviceRegulators])):
+        if any(not isinstance(i, int) for i in deviceRegulators):
             printRegulatorTypes()
             raise TypeError("Give integer value corresponding to regulator type from table above.")
-        if (any([i<0 for i in deviceRegulators]) or any([i>5 for i in deviceRegulators])):
+        if any(i < 0 or i > 5 for i in deviceRegulators):
             printRegulatorTypes()
             raise ValueError("Unknown device regulator selected, choose from list above")
         if any( [elveflowDLL!=None, elveflowSDK!= None] ):
-            if ( not pathlib.Path(elveflowDLL).exists() ) or ( not pathlib.Path(elveflowSDK).exists() ):
+            if not ( os.path.exists(elveflowDLL) and os.path.exists(elveflowSDK) ):
                 raise FileNotFoundError("I could not find the given paths to the Elveflow DLL and/or Python SDK")
             
         self.deviceName = deviceName
@@ -61,9 +70,17 @@ class OB1elve:
         self.ELVEFLOW_DLL = elveflowDLL
         self.ELVEFLOW_SDK = elveflowSDK
         self.insideRemote = False
-        self.confPIDs = [False,False,False,False]
-        self.runningPIDs = [False,False,False,False]
+        self._setUniversalReaders()
+        self.confPIDs = [False]*self.nChannels
+        self.runningPIDs = [False]*self.nChannels
         self.deviceID = deviceID
+        self._calib = CALIB_T() # This is where callibration is stored! Filled in place, so the pointer below stays valid.
+        self._calib_ref = byref(self._calib)
+        self._calibLoaded = False # buffer above is all zeros until a callibration is loaded or performed
+        self._calib_np = np.frombuffer(self._calib, dtype=np.float64) # numpy view on the same memory, changes show up in both
+        self.calib_np = self._calib_np.view() # read-only version for users; set callibration through calib, so it is marked as loaded
+        self.calib_np.flags.writeable = False
+        self._channels = {i : c_int32(i) for i in range(1,self.nChannels+1)} # c datatype versions of the valid channel numbers
         self.loadDLL()
 
     def open(self):
@@ -80,7 +97,7 @@ class OB1elve:
                 self.deviceName = common.read_config("ob1_name")
 
         self.Instr_ID = c_int32()
-        error = self.ef.OB1_Initialization(
+        error = self._OB1_Initialization(
             self.deviceName.encode('ascii'),
             self.deviceRegulators[0],
             self.deviceRegulators[1],
@@ -89,6 +106,17 @@ class OB1elve:
             byref(self.Instr_ID)
         )
         common.raiseEFerror(error,'Initialize connection to OB1')
+        self._instr_id = self.Instr_ID.value # cached, so we do not have to go through the c_int32 for every call
+        # Reusable buffers for the DLL to write readings in, so we do not allocate new ones on every read.
+        # This does mean one OB1elve object should not be read from multiple threads at the same time.
+        self._p_buf = c_double()
+        self._s_buf = c_double()
+        self._p_ptr = pointer(self._p_buf) # prebuilt pointers, so no byref is needed on every call
+        self._s_ptr = pointer(self._s_buf)
+        n = self.nChannels
+        self._pressures_buf = (c_double*n)() # pressures to set with setPressureBulk
+        self._bulk = (c_double*(2*n))() # pressures of all channels, followed by sensor data of all channels
+        self._bulk_refs = [byref(c_double.from_buffer(self._bulk, i*sizeof(c_double))) for i in range(2*n)]
     
     def close(self):
         """
@@ -100,20 +128,34 @@ class OB1elve:
             except ConnectionError as e:
                 # If not gracefull, force the issue
                 print(f'Remote process could not be stopped ({e}), but closing connection anyway.')
-        error = self.ef.OB1_Destructor(self.Instr_ID)
+        error = self._OB1_Destructor(self._instr_id)
         common.raiseEFerror(error,'Closing connection to OB1')
 
     def loadDLL(self):
         """
-        Load Elveflow DLL and acompanying Python SDK.
-        """
-        if self.ELVEFLOW_DLL != None or self.ELVEFLOW_SDK != None:
-            sys.path.append(self.ELVEFLOW_DLL)
-            sys.path.append(self.ELVEFLOW_SDK)
-        else:
-            common.add_elveflow_to_path()
-        import Elveflow64 as ef
-        self.ef = ef
+        Load Elveflow DLL and acompanying Python SDK. The DLL functions are bound to the class, so this work is only done once per process.
+        """
+        ef = common.load_elveflow(self.ELVEFLOW_DLL, self.ELVEFLOW_SDK)
+        cls = type(self)
+        if cls.ef is not ef:
+            cls.ef = ef
+            # Set up DLL functions once, with their prototypes, instead of on every call
+            calib_p = POINTER(CALIB_T)
+            cls._OB1_Initialization = staticmethod(common.bind_dll_function(ef, "OB1_Initialization", [c_char_p, c_uint16, c_uint16, c_uint16, c_uint16, POINTER(c_int32)]))
+            cls._OB1_Destructor = staticmethod(common.bind_dll_function(ef, "OB1_Destructor", [c_int32]))
+            cls._OB1_Calib = staticmethod(common.bind_dll_function(ef, "OB1_Calib", [c_int32, calib_p, c_int32]))
+            cls._OB1_Set_Press = staticmethod(common.bind_dll_function(ef, "OB1_Set_Press", [c_int32, c_int32, c_double, calib_p, c_int32]))
+            cls._OB1_Set_All_Press = staticmethod(common.bind_dll_function(ef, "OB1_Set_All_Press", [c_int32, POINTER(c_double), calib_p, c_int32, c_int32]))
+            cls._OB1_Get_Press = staticmethod(common.bind_dll_function(ef, "OB1_Get_Press", [c_int32, c_int32, c_int32, calib_p, POINTER(c_double), c_int32]))
+            cls._OB1_Add_Sens = staticmethod(common.bind_dll_function(ef, "OB1_Add_Sens", [c_int32, c_int32, c_uint16, c_uint16, c_uint16, c_uint16, c_double]))
+            cls._OB1_Get_Sens_Data = staticmethod(common.bind_dll_function(ef, "OB1_Get_Sens_Data", [c_int32, c_int32, c_int32, POINTER(c_double)]))
+            cls._OB1_Start_Remote_Measurement = staticmethod(common.bind_dll_function(ef, "OB1_Start_Remote_Measurement", [c_int32, calib_p, c_int32]))
+            cls._OB1_Stop_Remote_Measurement = staticmethod(common.bind_dll_function(ef, "OB1_Stop_Remote_Measurement", [c_int32]))
+            cls._OB1_Get_Remote_Data = staticmethod(common.bind_dll_function(ef, "OB1_Get_Remote_Data", [c_int32, c_int32, POINTER(c_double), POINTER(c_double)]))
+            cls._OB1_Set_Remote_Target = staticmethod(common.bind_dll_function(ef, "OB1_Set_Remote_Target", [c_int32, c_int32, c_double]))
+            cls._PID_Add_Remote = staticmethod(common.bind_dll_function(ef, "PID_Add_Remote", [c_int32, c_int32, c_int32, c_int32, c_double, c_double, c_int32]))
+            cls._PID_Set_Running_Remote = staticmethod(common.bind_dll_function(ef, "PID_Set_Running_Remote", [c_int32, c_int32, c_int32]))
+            cls._PID_Set_Params_Remote = staticmethod(common.bind_dll_function(ef, "PID_Set_Params_Remote", [c_int32, c_int32, c_int32, c_double, c_double]))
 
     def loadCallibration(self, path:str = None):
         """
@@ -122,7 +164,7 @@ class OB1elve:
         Parameters
         ----------
         path : str (path), optional
-            Path to callibration file (must be json!). Defaults to the standard callibration location, as given when creating this OB1elve object.
+            Path to callibration file, as saved by performCallibration. Defaults to the standard callibration location, as given when creating this OB1elve object.
         """
         if path is None:
             if self.deviceID:
@@ -134,9 +176,11 @@ class OB1elve:
                 path = common.read_config("ob1_callibration")
         elif type(path) != str:
             raise TypeError("Give callibration file path as string")
-        elif not pathlib.Path(path).exists():
+        elif not os.path.exists(path):
             raise ValueError(f"No callibration file found at '{path}', please set different path or perform callibration using OB1elve.performCallibration()")
-        self.calib = loadCalibration(path)
+        self._calibLoaded = False # in case loading fails halfway
+        loadCalibration(path, out=self._calib) # straight into the existing buffer, so the pointer to it stays valid
+        self._calibLoaded = True
 
     def performCallibration(self, path:str = None):
         """
@@ -145,7 +189,7 @@ class OB1elve:
         Parameters
         ----------
         path : str (path), optional
-            Path where to save callibration file (will be a .json file!). Defaults to the standard callibration location, see docs.
+            Path where to save callibration file (binary file, see saveCalibration). Defaults to the standard callibration location, see docs.
         """
         if self.insideRemote:
             raise ValueError("Remote loop is running; only inside loop functions allowed!")
@@ -163,20 +207,38 @@ class OB1elve:
             raise TypeError("Give callibration file path as string")
         print("This will take ~5 minutes. Longer means kernel died. Make sure the channels are properly plugged.")
         # Perform new callibration
-        self.calib = (c_double*1000)() # This is where callibration is stored!
-        error = self.ef.OB1_Calib(self.Instr_ID.value, self.calib, 1000)
+        error = self._OB1_Calib(self._instr_id, self._calib, CALIB_LEN)
         common.raiseEFerror(error,'Performing callibration')
+        self._calibLoaded = True
         # first backup old callibration if it exists, before overwriting with new data!
-        if pathlib.Path(path).exists():
+        if os.path.exists(path):
             oldCal = pathlib.Path(path)
             age =  datetime.datetime.fromtimestamp( oldCal.stat().st_mtime, tz=datetime.timezone.utc)
             agestring = age.strftime(r'%Y%m%d')
             oldCal.rename( str(oldCal.absolute()) + "." + agestring )
             print("Old callibration is backed up") 
         # and save
-        saveCalibration(self.calib, path)
+        saveCalibration(self._calib, path)
         print("New callibration was performed and saved.")
 
+    @property
+    def calib(self):
+        """Pressure callibration (array of 1000 c_double) that is passed to the device. Set it by assigning to calib (not by changing calib_np, which is read-only)."""
+        return self._calib
+
+    @calib.setter
+    def calib(self, calibrationData):
+        calibrationData = np.asarray(calibrationData, dtype=np.float64)
+        if calibrationData.shape != (CALIB_LEN,):
+            raise ValueError("Calibrationdata should be {0} elements, not {1} elements".format(CALIB_LEN,calibrationData.size))
+        np.copyto(self._calib_np, calibrationData)
+        self._calibLoaded = True
+
+    def _calibCheck(self):
+        """Raise an error if no callibration was loaded or performed, instead of sending an empty one to the device."""
+        if not self._calibLoaded:
+            raise ValueError("No pressure callibration loaded; use loadCallibration() or performCallibration() first")
+
     def setPressure(self, 
                     channel: int, 
                     pressure: float = 0):
@@ -192,10 +254,10 @@ class OB1elve:
         """
         if self.insideRemote:
             raise ValueError("Remote loop is running; only inside loop functions allowed!")
+        self._calibCheck()
         channel = self._channelCheck( int(channel) )
-        pressure = c_double( float(pressure) ) # convert to c_double
-        error = self.ef.OB1_Set_Press( self.Instr_ID.value, channel, pressure, byref(self.calib),1000)
-        common.raiseEFerror(error,'Setting pressure')
+        error = self._OB1_Set_Press( self._instr_id, channel, float(pressure), self._calib_ref,CALIB_LEN)
+        if error: common.raiseEFerror(error,'Setting pressure')
 
     def getPressure(self, channel:int) -> float:
         """
@@ -208,38 +270,66 @@ class OB1elve:
         """
         if self.insideRemote:
             raise ValueError("Remote loop is running; only inside loop functions allowed!")
+        self._calibCheck()
         channel = self._channelCheck(channel)
-        pressure = c_double()
-        error = self.ef.OB1_Get_Press(self.Instr_ID.value, channel, 1, byref(self.calib),byref(pressure), 1000) # Acquire_data=1 -> read all the analog values
-        common.raiseEFerror(error,'Getting pressure')
-        return pressure.value
-
-    # def setPressureBulk(self, 
-    #                     pressures: list[float] = [0, 0, 0, 0]):
-    #     """
-    #     Set pressure of all channels in one go. If you want to set the pressure of 1 channel, use setPressure
-
-    #     WARNING: NOT FUNCTIONAL - Something goes wrong with ctypes here. The DLL expects a c_double, but I need to input 4 values. Not sure how to fix that. Giving one value will set only the first channel, sooooo. Ask stackOverflow or Elveflow (haha)?
-
-    #     Parameters
-    #     ----------
-    #     pressures : list-like
-    #         Pressure in mbar for each channel, with idx 0 being the first channel.
-    #     """
-    #     if self.insideRemote:
-    #         raise ValueError("Remote loop is running; only inside loop functions allowed!")
-    #     try: 
-    #         pressures = list(pressures)
-    #     except TypeError:
-    #         raise TypeError("input pressures must be list-like")
-    #     if len(pressures) != 4:
-    #         raise ValueError("Exactly 4 Pressures need to be given here")
-    #     pressuresArray = (c_double * len(pressures))(*pressures) # This magically converts data type
-        
-    #     firstArrayPoint = pressuresArray[0]
-    #     lenghtOfPressureArray = c_int(len(pressures))
-    #     error = self.ef.OB1_Set_All_Press( self.Instr_ID.value, byref(pressuresArray), byref(self.calib),4,1000)
-        # common.raiseEFerror(error,'Setting pressure')
+        error = self._OB1_Get_Press(self._instr_id, channel, 1, self._calib_ref,self._p_ptr, CALIB_LEN) # Acquire_data=1 -> read all the analog values
+        if error: common.raiseEFerror(error,'Getting pressure')
+        return self._p_buf.value
+
+    def getAllPressures(self, missingAsNaN: bool = False) -> np.ndarray:
+        """
+        Read pressure of all channels. New analog values are only acquired for the first channel, the others reuse that acquisition, so the device is not asked for every channel.
+
+        Parameters
+        ----------
+        missingAsNaN : bool, optional
+            If True, channels that cannot be read are returned as NaN, instead of raising an error. Only errors meaning the device itself cannot be reached (common.DEVICE_ERRORCODES) still raise. By default False.
+
+        Returns
+        -------
+        pressures : numpy.ndarray
+            pressure readings of channel 1 to nChannels
+        """
+        if self.insideRemote:
+            raise ValueError("Remote loop is running; only inside loop functions allowed!")
+        self._calibCheck()
+        out = np.empty(self.nChannels)
+        acquire = 1
+        for i in range(self.nChannels):
+            error = self._OB1_Get_Press(self._instr_id, self._channels[i+1], acquire, self._calib_ref, self._p_ptr, CALIB_LEN)
+            if error:
+                if not missingAsNaN or abs(error) in common.DEVICE_ERRORCODES:
+                    common.raiseEFerror(error,f'Getting pressure of channel {i+1}')
+                out[i] = np.nan
+            else:
+                out[i] = self._p_buf.value
+                acquire = 0 # Data is acquired, rest can use it
+        return out
+
+    def setPressureBulk(self, 
+                        pressures: list[float] = None):
+        """
+        Set pressure of all channels in one go, with a single call to the device. If you want to set the pressure of 1 channel, use setPressure
+
+        Parameters
+        ----------
+        pressures : list-like
+            Pressure in mbar for each channel (nChannels values), with idx 0 being the first channel. Defaults to 0 for all channels.
+        """
+        if self.insideRemote:
+            raise ValueError("Remote loop is running; only inside loop functions allowed!")
+        self._calibCheck()
+        if pressures is None:
+            pressures = [0]*self.nChannels
+        try: 
+            pressures = list(pressures)
+        except TypeError:
+            raise TypeError("input pressures must be list-like")
+        if len(pressures) != self.nChannels:
+            raise ValueError(f"Exactly {self.nChannels} Pressures need to be given here")
+        self._pressures_buf[:] = [float(p) for p in pressures] # reuse the same array, passed as a double* thanks to the prototype
+        error = self._OB1_Set_All_Press( self._instr_id, self._pressures_buf, self._calib_ref, self.nChannels, CALIB_LEN)
+        if error: common.raiseEFerror(error,'Setting pressure')
 
     def addSensor(self, channel:int, sensorType:int, resolution:int = 7, sensorDig:int = 1,sensorIPACalib:int = 0, sensorCustVolt:float = 5.01):
         """
@@ -276,7 +366,7 @@ class OB1elve:
         sensorCustVolt = c_double( sensorCustVolt ) # mandatory unused argument
         
         # The arguments for the next function are: 1. The OB1 ID obtained at its initialization. 2 Channel to which the sensor is attached. 3 Sensor type (see below). 4 Digital (1) or Analog (0) communication. - Calibration: IPA (1) or H20 (0). - Resolution bits (see below). - Voltage for custom analog sensors, from 5 to 25V.
-        error = self.ef.OB1_Add_Sens( self.Instr_ID.value, channel, sensorType, sensorDig, sensorIPACalib, resolution, sensorCustVolt) 
+        error = self._OB1_Add_Sens( self._instr_id, channel, sensorType, sensorDig, sensorIPACalib, resolution, sensorCustVolt) 
         common.raiseEFerror(error,'Connecting to sensor')
 
     def getSensorData(self, channel:int) -> float:
@@ -296,12 +386,40 @@ class OB1elve:
         if self.insideRemote:
             raise ValueError("Remote loop is running; only inside loop functions allowed!")
         channel = self._channelCheck(channel)
-        data = c_double()
-        acquireData1True0False = c_int32( 1 ) # required variable with no effect on digital sensors.
-        error = self.ef.OB1_Get_Sens_Data(self.Instr_ID.value, channel, acquireData1True0False, byref(data))
-        common.raiseEFerror(error,"Getting sensor data")
-        return data.value
+        acquireData1True0False = 1 # required variable with no effect on digital sensors.
+        error = self._OB1_Get_Sens_Data(self._instr_id, channel, acquireData1True0False, self._s_ptr)
+        if error: common.raiseEFerror(error,"Getting sensor data")
+        return self._s_buf.value
     
+    def getAllSensorData(self, missingAsNaN: bool = False) -> np.ndarray:
+        """
+        Get readings from the sensors at all channels, given in native units (so probably uL/min). As in getAllPressures, new (analog) data is only acquired once.
+
+        Parameters
+        ----------
+        missingAsNaN : bool, optional
+            If True, channels that cannot be read (e.g. because no sensor is attached) are returned as NaN, instead of raising an error. Only errors meaning the device itself cannot be reached (common.DEVICE_ERRORCODES) still raise. By default False.
+
+        Returns
+        -------
+        values : numpy.ndarray
+            sensor data readings of channel 1 to nChannels
+        """
+        if self.insideRemote:
+            raise ValueError("Remote loop is running; only inside loop functions allowed!")
+        out = np.empty(self.nChannels)
+        acquire = 1
+        for i in range(self.nChannels):
+            error = self._OB1_Get_Sens_Data(self._instr_id, self._channels[i+1], acquire, self._s_ptr)
+            if error:
+                if not missingAsNaN or abs(error) in common.DEVICE_ERRORCODES:
+                    common.raiseEFerror(error,f'Getting sensor data of channel {i+1}')
+                out[i] = np.nan
+            else:
+                out[i] = self._s_buf.value
+                acquire = 0 # Data is acquired, rest can use it
+        return out
+
     def startRemote(self):
         """
         This will start "remote operation mode", a control loop in the background which automatically reads all sensors and regulators. No direct call to the OB1 can be made until the stopRemote function is called. Until then only function accessing this loop (remoteGetData, remoteSetTarget) are allowed.
@@ -309,9 +427,11 @@ class OB1elve:
         """
         if self.insideRemote:
             raise ValueError("Remote loop is allready running and can thus not be started")
-        error = self.ef.OB1_Start_Remote_Measurement(self.Instr_ID.value,byref(self.calib),1000)
+        self._calibCheck()
+        error = self._OB1_Start_Remote_Measurement(self._instr_id,self._calib_ref,CALIB_LEN)
         common.raiseEFerror(error,"Starting control loop")
         self.insideRemote = True # This tells other functions to stop working, since inside the loop you are only allowed to use 'inside loop functions'
+        self._setUniversalReaders()
 
     def stopRemote(self):
         """
@@ -319,12 +439,13 @@ class OB1elve:
         """
         if not self.insideRemote:
             raise ValueError("Remote loop is not running and can thus not be stopped")
-        error = self.ef.OB1_Stop_Remote_Measurement(self.Instr_ID.value)
+        error = self._OB1_Stop_Remote_Measurement(self._instr_id)
         if error != 2:
             common.raiseEFerror(error,"Stopping control loop")
-        self.confPIDs = [False,False,False,False] # Reset these values
-        self.runningPIDs = [False,False,False,False]
+        self.confPIDs = [False]*self.nChannels # Reset these values
+        self.runningPIDs = [False]*self.nChannels
         self.insideRemote = False
+        self._setUniversalReaders()
 
     def remoteGetData(self,channel : int) -> tuple[float,float]:
         """
@@ -345,12 +466,33 @@ class OB1elve:
         if not self.insideRemote:
             raise ValueError("Remote loop is not running, use regular getPressure/getSensorData functions")
         channel = self._channelCheck(channel)
-        dataP = c_double()
-        dataS = c_double()
-        error = self.ef.OB1_Get_Remote_Data(self.Instr_ID.value,channel,byref(dataP),byref(dataS))
-        common.raiseEFerror(error,"Getting data inside control loop")
-        return dataP.value, dataS.value
+        error = self._OB1_Get_Remote_Data(self._instr_id,channel,self._p_ptr,self._s_ptr)
+        if error: common.raiseEFerror(error,"Getting data inside control loop")
+        return self._p_buf.value, self._s_buf.value
         
+    def remoteGetAllData(self) -> tuple[tuple[float, ...],tuple[float, ...]]:
+        """
+        Read data from all pressure channels and sensors while inside the remote operation mode. Use this instead of calling remoteGetData for every channel if you need all of them.
+
+        Returns
+        -------
+        Pressures : tuple of floats
+            pressure readings of channel 1 to nChannels
+        SensorData : tuple of floats
+            sensor data readings of channel 1 to nChannels
+        """
+        if not self.insideRemote:
+            raise ValueError("Remote loop is not running, use regular getPressure/getSensorData functions")
+        getRemoteData = self._OB1_Get_Remote_Data
+        iid = self._instr_id
+        refs = self._bulk_refs
+        n = self.nChannels
+        for i in range(n):
+            error = getRemoteData(iid, self._channels[i+1], refs[i], refs[i+n])
+            if error: common.raiseEFerror(error,"Getting data inside control loop")
+        b = self._bulk
+        return tuple(b[:n]), tuple(b[n:])
+
     def remoteSetTarget(self, channel: int, target: float):
         """
         Set the target value of a channel in the remote loop. If NO PID is running, the target is the pressure in mbar, if a PID IS running, this sets the target sensor value (probably uL/min), towards which the PID is working.
@@ -365,9 +507,94 @@ class OB1elve:
         if not self.insideRemote:
             raise ValueError("Remote loop is not running, start it firts to use PID-like processes.")
         channel = self._channelCheck(channel)
-        target = c_double( target ) # convert to double
-        error = self.ef.OB1_Set_Remote_Target(self.Instr_ID.value, channel, target)
-        common.raiseEFerror(error,"Set target pressure/flow rate inside control loop")
+        error = self._OB1_Set_Remote_Target(self._instr_id, channel, float(target))
+        if error: common.raiseEFerror(error,"Set target pressure/flow rate inside control loop")
+
+    def remoteControlLoop(self, channel: int, callback, rate: float = 100, duration: float = 60):
+        """
+        Run your own control loop inside the remote operation mode: every cycle, the pressure and sensor value of channel are read, passed to callback(pressure, sensorData), and whatever it returns is set as new target with remoteSetTarget. This blocks for duration seconds.
+
+        Parameters
+        ----------
+        channel : int
+            Channel number between 1 and 4
+        callback : callable
+            Function taking (pressure, sensorData) and returning the new target.
+        rate : float, optional
+            How often to run the loop, in Hz, by default 100
+        duration : float, optional
+            How long to run the loop, in seconds, by default 60
+        """
+        if not self.insideRemote:
+            raise ValueError("Remote loop is not running, start it first to run a control loop.")
+        channel = self._channelCheck(channel)
+        getRemoteData = self._OB1_Get_Remote_Data
+        setRemoteTarget = self._OB1_Set_Remote_Target
+        iid = self._instr_id
+        ptrP, ptrS = self._p_ptr, self._s_ptr
+        bufP, bufS = self._p_buf, self._s_buf
+        period = 1 / rate
+        now = time.perf_counter
+        end = now() + duration
+        lastWarn = dict()
+        deadline = now()
+        while deadline < end:
+            error = getRemoteData(iid, channel, ptrP, ptrS)
+            if error: common.raiseEFerror(error,"Getting data inside control loop")
+            error = setRemoteTarget(iid, channel, float(callback(bufP.value, bufS.value)))
+            if error: common.raiseEFerror(error,"Set target pressure/flow rate inside control loop")
+            deadline += period
+            sleeptime = deadline - now()
+            if sleeptime > 0:
+                time.sleep(sleeptime)
+            else:
+                common.throttledWarn(lastWarn, "rate", f"Requested control loop rate ({rate} Hz) could not be reached, running as fast as possible instead")
+                deadline = now() # Start counting again from here, instead of firing the callback in a burst to catch up
+
+    def remoteRecord(self, channel: int, samples: int, rate: float = 1000) -> np.ndarray:
+        """
+        Record pressure and sensor data of channel at a fixed rate inside the remote operation mode, straight into a numpy array. This blocks until all samples are taken.
+        Timing is done by sleeping until ~1 ms before each sample and busy-waiting the rest, so it keeps one CPU core busy, but jitter is typically well below a millisecond. If the device cannot keep up with the requested rate, samples are simply taken as fast as possible.
+
+        Parameters
+        ----------
+        channel : int
+            Channel number between 1 and 4
+        samples : int
+            Number of samples to take
+        rate : float, optional
+            Sample rate in Hz, by default 1000
+
+        Returns
+        -------
+        data : numpy.ndarray
+            Array of shape (samples, 3), with columns time since start (seconds), pressure and sensor data.
+        """
+        if not self.insideRemote:
+            raise ValueError("Remote loop is not running, use regular getPressure/getSensorData functions")
+        channel = self._channelCheck(channel)
+        out = np.empty((int(samples), 3), dtype=np.float64)
+        getRemoteData = self._OB1_Get_Remote_Data
+        iid = self._instr_id
+        ptrP, ptrS = self._p_ptr, self._s_ptr
+        bufP, bufS = self._p_buf, self._s_buf
+        now = time.perf_counter_ns
+        sleep = time.sleep
+        period = int(1e9 / rate)
+        t0 = now()
+        for i in range(len(out)):
+            target = t0 + i * period
+            remaining = target - now()
+            if remaining > 2_000_000:
+                sleep((remaining - 1_000_000) * 1e-9) # leave ~1 ms to busy-wait, time.sleep is not accurate enough
+            while now() < target:
+                pass
+            error = getRemoteData(iid, channel, ptrP, ptrS)
+            if error: common.raiseEFerror(error,"Getting data inside control loop")
+            out[i,0] = (now() - t0) * 1e-9
+            out[i,1] = bufP.value
+            out[i,2] = bufS.value
+        return out
 
     def remoteAddPID(self, channelP: int, channelS:int, P:float, I:float, run:bool = True):
         """
@@ -396,8 +623,8 @@ class OB1elve:
         P = c_double( P )
         I = c_double( I )
         run = c_int32( int(run) )
-        sensorID = self.Instr_ID.value # this is never set??? Set to same ID as OB1???
-        error= self.ef.PID_Add_Remote(self.Instr_ID.value, channelP, sensorID, channelS, P, I , run)
+        sensorID = self._instr_id # this is never set??? Set to same ID as OB1???
+        error= self._PID_Add_Remote(self._instr_id, channelP, sensorID, channelS, P, I , run)
         common.raiseEFerror(error,"Setup PID control loop")
         self.confPIDs[int(channelP.value)-1] = {'P':P.value,'I':I.value}
         self.runningPIDs[int(channelP.value)-1] = bool(int(run.value))
@@ -420,7 +647,7 @@ class OB1elve:
         if not type(self.confPIDs[int(channel.value)-1]) == dict:
             raise ValueError("No PID setup in this channel")
         run = c_int32( int(run) )
-        error = self.ef.PID_Set_Running_Remote( self.Instr_ID.value, channel, run )
+        error = self._PID_Set_Running_Remote( self._instr_id, channel, run )
         self.runningPIDs[int(channel.value)-1] = bool(run.value)
         return error
 
@@ -432,7 +659,7 @@ class OB1elve:
         reset = c_int32( int(True) )
         P = c_double( self.confPIDs[int(channel.value)-1]["P"] )
         I = c_double( self.confPIDs[int(channel.value)-1]["I"] )
-        error = self.ef.PID_Set_Params_Remote( self.Instr_ID.value, channel, reset, P, I )
+        error = self._PID_Set_Params_Remote( self._instr_id, channel, reset, P, I )
         common.raiseEFerror(error,"Reset PID control loop")
 
     def remoteChangePID(self, channel:int, P:float, I:float, reset:bool = True):
@@ -456,7 +683,7 @@ class OB1elve:
         P = c_double( P )
         I = c_double( I )
         reset = c_int32( int(reset) )
-        error = self.ef.PID_Set_Params_Remote( self.Instr_ID.value, channel, reset, P, I )
+        error = self._PID_Set_Params_Remote( self._instr_id, channel, reset, P, I )
         common.raiseEFerror(error,"Changing PID control loop parameters")
         self.confPIDs[int(channel.value)-1]["P"] = P.value
         self.confPIDs[int(channel.value)-1]["I"] = I.value
@@ -465,24 +692,33 @@ class OB1elve:
         """Check whether inputed channel number is valid, and return c datatype version of number"""
         if type(channel) == c_int32:
             return channel
-        if not 1 <= channel <= 4:
+        try:
+            return self._channels[channel]
+        except KeyError:
             raise ValueError("Channel choice between 1 and 4")
-        return c_int32( int( channel ) ) # convert to c_int32
 
     def getPressureUniversal(self, channel:int) -> float:
         """This function gets the pressure, without bothering you with details about remote operation mode and stuff like that."""
-        if self.insideRemote:
-            return self.remoteGetData(channel)[0]
-        else:
-            return self.getPressure(channel)
+        return self._readPressure(channel)
     
     def getFlowUniversal(self, channel:int) -> float:
         """This function gets the flow sensor readout in µl/min, without bothering you with details about remote operation mode and stuff like that."""
+        return self._readFlow(channel)
+
+    def _setUniversalReaders(self):
+        """Point the universal getters to the right functions for the current mode, so they do not have to check the mode on every call"""
         if self.insideRemote:
-            return self.remoteGetData(channel)[1]
-        
+            self._readPressure = self._remoteGetPressure
+            self._readFlow = self._remoteGetFlow
         else:
-            return self.getSensorData(channel)            
+            self._readPressure = self.getPressure
+            self._readFlow = self.getSensorData
+
+    def _remoteGetPressure(self, channel:int) -> float:
+        return self.remoteGetData(channel)[0]
+
+    def _remoteGetFlow(self, channel:int) -> float:
+        return self.remoteGetData(channel)[1]
 
 
     def __enter__(self):
@@ -493,32 +729,51 @@ class OB1elve:
         #Exception handling here, if an error occurs in the with block
         self.close()
 
-def saveCalibration(calibrationData: list[c_double], location: str):
+def saveCalibration(calibrationData: list[c_double], location: str, legacyJSON: bool = False):
     """
-    Saves the inputted calibrationdata as plain text at location. Note that callibrationData type should be a list of c_double!
+    Saves the inputted calibrationdata at location, as raw doubles (native byte order) after a short header. Note that callibrationData type should be a list of c_double!
+    Set legacyJSON to True to save as plain text json instead, like older versions of this module did.
     This native Python function replaces the Elveflow DLL function because that kept crashing for some reason.
     """
     try:
-        calibrationData = list(calibrationData)
+        calibrationData = array.array('d', calibrationData)
     except TypeError:
         raise TypeError("Callibration data is supposed to be a list-like object")
-    with open(location, "wt") as f:
-        json.dump(calibrationData,f,indent='\t')
-
-def loadCalibration(location: str):
+    if legacyJSON:
+        with open(location, "wt") as f:
+            json.dump(calibrationData.tolist(),f,indent='\t')
+        return
+    with open(location, "wb") as f:
+        f.write(_CALIB_HEADER)
+        calibrationData.tofile(f)
+
+def loadCalibration(location: str, out = None):
     """
-    loads calibration data from plain text json file at location. Note that callibrationData needs to be generated with the saveCalibration function, not the Elveflow DLL function. Returns result as tuple of c_double!
+    loads calibration data from file at location. Note that callibrationData needs to be generated with the saveCalibration function, not the Elveflow DLL function. Returns result as array of c_double!
+    Files without the binary header are read as plain text json, which is what older versions of this module saved.
+    If out (an existing CALIB_T array) is given, the data is copied straight into it, and it is returned, instead of a new array.
     This native Python function replaces the Elveflow DLL function because that kept crashing for some reason.
     """
     if type(location) not in [str,]:
         raise TypeError("Input path should be str!")
-    with open(location, "rt") as f:
+    if out is None:
+        out = CALIB_T()
+    elif not isinstance(out, CALIB_T):
+        raise TypeError("out should be a CALIB_T array")
+    with open(location, "rb") as f:
+        if f.read(len(_CALIB_HEADER)) == _CALIB_HEADER:
+            calibrationDataDouble = out
+            nbytes = f.readinto(calibrationDataDouble) # read straight into the ctypes array
+            if nbytes != sizeof(CALIB_T) or f.read(1):
+                raise ValueError("Calibrationdata in file is misformed: should be {0} doubles".format(CALIB_LEN))
+            return calibrationDataDouble
+        f.seek(0)
         calibrationData = json.load(f)
-    if len(calibrationData) != 1000:
-        raise ValueError("Calibrationdata in file is misformed: should be list of 1000 elements, not {0} elements".format(len(calibrationData)))
-    calibrationDataDouble = (c_double*len(calibrationData))(*calibrationData) # Prepare object
-    #for i in range(len(calibrationData)):
-    #    calibrationDataDouble[i] = c_double(calibrationData[i])
+    if len(calibrationData) != CALIB_LEN:
+        raise ValueError("Calibrationdata in file is misformed: should be list of {0} elements, not {1} elements".format(CALIB_LEN,len(calibrationData)))
+    calibrationData = array.array('d', calibrationData)
+    calibrationDataDouble = out
+    memmove(calibrationDataDouble, calibrationData.buffer_info()[0], sizeof(CALIB_T)) # one copy instead of converting every element
     return calibrationDataDouble
 
 def printSensorTypes():
@@ -1,5 +1,5 @@
+import json
 import pycrofluidics.common as common
-import ruamel.yaml as yaml
 
 def main():
     """
@@ -7,17 +7,17 @@ def main():
     """
     basepath = common.where_is_the_config_dir()
     configfile = common.where_is_the_config_file()
-    yo = yaml.YAML()
-    yo.dump(
-        {
-            'elveflow_dll': "/path/to/the/elveflow/dll",
-            'elveflow_sdk': "/path/to/the/elveflow/sdk",
-            'ob1_name' : "ASRL3::INSTR",
-            'mux_name' : "ASRL4::INSTR",
-            'ob1_callibration' : (basepath / "ob1_pressurechannel.callibration").as_posix(),
-        },
-        configfile
-    )
+    defaults = {
+        'elveflow_dll': "/path/to/the/elveflow/dll",
+        'elveflow_sdk': "/path/to/the/elveflow/sdk",
+        'ob1_name' : "ASRL3::INSTR",
+        'mux_name' : "ASRL4::INSTR",
+        'ob1_callibration' : (basepath / "ob1_pressurechannel.callibration").as_posix(),
+    }
+    # JSON is also valid YAML, so the config reader takes it as is, and json quotes values (like Windows paths) properly.
+    # No need to import a YAML library just to write this.
+    with open(configfile, "w") as f:
+        json.dump(defaults, f, indent=2)
     print(f"Configuration file was placed in:\n\t{configfile}\nPlease adapt it manually!")
 
 if __name__ == "__main__":
@@ -2,13 +2,25 @@
 This file contains functions with convenient standard protocol things, like a sweeping over a range of pressures to see what the corresponding flow rate is.
 """
 
+import os
+import csv
 import time
-import warnings
 import numpy as np
 import pandas as pd
 import pathlib
 import threading
+import queue
 import pycrofluidics
+import pycrofluidics.common as common
+
+def dataColumns(nChannels = 4):
+    """Columns of the data returned/saved by acquireData, acquireDataCont and pressureSweep, for a device with nChannels channels."""
+    return (
+        ["Unix time (seconds)","Time (seconds)"]
+        + [f"Pressure Ch. {i+1} (mbar)" for i in range(nChannels)]
+        + [f"Flow Ch. {i+1} (ul/min)" for i in range(nChannels)]
+        + ["measuring time (seconds)"]
+    )
 
 def injectVolume(ob1elve, muxelve, pressure_channel, flowrate_sensor_channel, inject_valve_channel, volume, stop_valve_channel = False, pressure = False, max_flow = 80, flow_rate = False, pollrate = 20):
     """
@@ -43,35 +55,61 @@ def injectVolume(ob1elve, muxelve, pressure_channel, flowrate_sensor_channel, in
     if pressure and flow_rate:
         raise ValueError("Either set fixed pressure or fixed flow. Not both")
     # prep before turning on flow:
-    volume_injected = 0 # µl
+    volume_injected = 0.0 # µl
+    volume_error = 0.0 # running rounding error of volume_injected (Kahan summation), so many small steps still add up correctly
     loop_time = 1 / pollrate
 
-    # setup pressure etc
+    # setup pressure etc, and decide now how to stop the flow at the end
+    stop_fn = None
     if pressure:
         ob1elve.setPressure(pressure_channel,pressure)
+        stop_fn = lambda: ob1elve.setPressure(pressure_channel,0)
     elif flow_rate:
         ob1elve.remoteSetTarget(flowrate_sensor_channel,flow_rate)
+        stop_fn = lambda: ob1elve.remoteSetTarget(flowrate_sensor_channel,0)
+    if stop_valve_channel:
+        stop_fn = lambda: muxelve.set_valve(stop_valve_channel)
     # setup MUX
     muxelve.set_valve(inject_valve_channel)
+    # Local names for everything used in the loop, skips the attribute lookups every iteration
+    now = time.perf_counter # monotonic() only ticks every ~15 ms on older Pythons on Windows
+    getFlow = ob1elve.getFlowUniversal
+    warn = common.throttledWarn
+    lastWarn = dict()
+    next_deadline = t_prev = now()
     while volume_injected < volume:
-        ts = time.time()
-        flow = ob1elve.getFlowUniversal(flowrate_sensor_channel)
-        volume_injected += flow * (loop_time/60) # µl/min * ( 1 sec / 60 sec )
+        ts = now()
+        flow = getFlow(flowrate_sensor_channel)
+        # Use the time that actually passed since the last reading, not loop_time, so a slow reading does not make me undercount the volume
+        step = flow * (ts - t_prev) / 60 - volume_error # µl/min * ( sec / 60 sec )
+        t_prev = ts
+        total = volume_injected + step
+        volume_error = (total - volume_injected) - step
+        volume_injected = total
         if flow > max_flow: 
             # TODO: this depends on the flow sensor, and could be read out automatically probably... Fine for now
-            warnings.warn(f"I detect flowrate is higher than can be measured accurately, currently {flow} µL/sec")
-        te = time.time()
-        sleeptime = loop_time - (te-ts)
-        if sleeptime < 0:
-            warnings.warn(f"I detect pollrate is set too high for communications (currently {pollrate} Hz, estimated max is {1/(te-ts)} Hz)")
-        time.sleep(loop_time - (te-ts))
-    if stop_valve_channel:
-        muxelve.set_valve(stop_valve_channel)
-    else:
-        if pressure:
-            ob1elve.setPressure(pressure_channel,0)
-        elif flow_rate:
-            ob1elve.remoteSetTarget(flowrate_sensor_channel,0)
+            warn(lastWarn, "flow", lambda: f"I detect flowrate is higher than can be measured accurately, currently {flow} µL/sec")
+        # Sleep until the next deadline, instead of a fixed time, so timing errors do not add up
+        next_deadline += loop_time
+        sleeptime = next_deadline - now()
+        if sleeptime > 0:
+            _preciseSleep(sleeptime)
+        else:
+            warn(lastWarn, "rate", lambda: f"I detect pollrate is set too high for communications (currently {pollrate} Hz, estimated max is {1/max(now()-ts, 1e-9):.3g} Hz)")
+            next_deadline = now() # Start counting again from here, instead of rushing to catch up
+    if stop_fn is not None:
+        stop_fn()
+
+def _preciseSleep(duration):
+    """
+    Sleep for duration seconds, more accurately than time.sleep (which can be ~15 ms off on Windows): sleep until 1 ms before the end, and busy-wait the last bit.
+    """
+    now = time.perf_counter # time.monotonic() can be just as coarse as time.sleep on Windows
+    end = now() + duration
+    if duration > 0.001:
+        time.sleep(duration - 0.001)
+    while now() < end:
+        pass
 
 def pressureSweep(ob1elve, channel, pressures, staticTime, acquisitionRate = 10, endAtZero = True):
     """
@@ -97,19 +135,17 @@ def pressureSweep(ob1elve, channel, pressures, staticTime, acquisitionRate = 10,
     result : pandas.DataFrame
         Pandas dataframe containing all measured data. Matches output of acquireData().
     """
-    for i in range(len(pressures)):
-        p = pressures[i]
+    frames = list() # concatenated once at the end, growing a DataFrame in the loop would copy it every step
+    for p in pressures:
         ob1elve.setPressure(channel,p)
-        data = acquireData(ob1elve, acquisitionRate, staticTime)
-        if i == 0:
-            result = data.copy()
-        else:
-            result = pd.concat([result,data],ignore_index=True)
+        frames.append(acquireData(ob1elve, acquisitionRate, staticTime))
     if endAtZero:
         ob1elve.setPressure(channel,0)
-    return result
+    if not frames:
+        return pd.DataFrame(columns=dataColumns(ob1elve.nChannels))
+    return pd.concat(frames,ignore_index=True)
 
-def acquireData(ob1elve, acquisitionRate=10, measureTime=60):
+def acquireData(ob1elve, acquisitionRate=10, measureTime=60, backend="pandas"):
     """
     Acquire data: passively read sensor data from Elveflow device, both pressures and flow rates (if sensors are connected).
 
@@ -121,101 +157,169 @@ def acquireData(ob1elve, acquisitionRate=10, measureTime=60):
         How often to check sensors. Give in Hz, by default 10. Note that this is approximate, more a guideline, due to the request taking some (variable) time, and me not thinking this is particularily important to be very accurate.
     measureTime : float, optional
         How long to monitor sensors, given in seconds, by default 60
+    backend : str, optional
+        What to return the data as: "pandas" (default) for a pandas.DataFrame, or "arrow" for a pyarrow.Table with float64 columns. The latter needs pyarrow, install it with 'pip install pycrofluidics[arrow]'.
 
     Returns
     -------
-    result : pandas.DataFrame
-        Pandas dataframe containing all measured data. Matches output of acquireData(). Columns are time, pressuredata, flowratedata, and the time it took to read all sensors (may be usefull for time-sensitive applications)
+    result : pandas.DataFrame or pyarrow.Table
+        Pandas dataframe (or arrow table) containing all measured data. Matches output of acquireData(). Columns are time, pressuredata, flowratedata, and the time it took to read all sensors (may be usefull for time-sensitive applications)
     """
-    # WARNING: Sort of implicitly assumes 4 channels
-    p = [False,False,False,False]
-    s = [False,False,False,False]
-    data = list()
-    breakTime = 1/acquisitionRate
-    measurementStart = time.time()
-    measurementEnd = measurementStart + measureTime
-    while True:
-        startTime = time.time()
-        if startTime > measurementEnd:
-            break
-        for i in range(4):
-            try:
-                p[i] =ob1elve.getPressure(i + 1)
-            except ConnectionError:
-                # Log it as a NaN, warn the user, and continnue as to not lose data
-                warnings.warn(f"Pressure in channel {i+1} could not be read at least once.")
-                p[i] = np.nan
-        for i in range(4):
-            try:
-                s[i] =ob1elve.getSensorData(i + 1)
-            except ConnectionError:
-                # Log it as a NaN, warn the user, and continnue as to not lose data
-                warnings.warn(f"Flowrate in channel {i+1} could not be read at least once.")
-                s[i] = np.nan
-        endTime = time.time()
-        delta = endTime - startTime
-        middleTime = startTime + (delta / 2)
-        timeSinceStart = middleTime - measurementStart
-        data.append([middleTime,timeSinceStart,*p,*s,delta])
-        if startTime-time.time() < breakTime:
-            time.sleep(breakTime)
-        else:
-            warnings.warn(f"Requested acquisition rate ({acquisitionRate} Hz) could not be reached, working at max possible rate instead (approx. {1 / delta} Hz)")
+    if backend == "arrow":
+        # Import before measuring, so you do not find out it is missing afterwards
+        try:
+            import pyarrow as pa
+        except ImportError as e:
+            raise ImportError("backend='arrow' requires pyarrow, install it with 'pip install pycrofluidics[arrow]'") from e
+    elif backend != "pandas":
+        raise ValueError(f"Unknown backend {backend}, choose 'pandas' or 'arrow'")
+    # Rows are written into a preallocated array, which is grown if the estimate is somehow too small
+    columns = dataColumns(ob1elve.nChannels)
+    n = 0
+    data = np.empty((int(measureTime * acquisitionRate) + 2, len(columns)))
+    for row in _sampleStream(ob1elve, acquisitionRate, measureTime):
+        if n == len(data):
+            data = np.concatenate([data, np.empty_like(data)])
+        data[n] = row
+        n += 1
+    if backend == "arrow":
+        return pa.Table.from_arrays(
+            [pa.array(data[:n,i], type=pa.float64()) for i in range(len(columns))],
+            names=columns
+        )
     result = pd.DataFrame(
-        data=data,
-        columns=[
-            "Unix time (seconds)","Time (seconds)", "Pressure Ch. 1 (mbar)", "Pressure Ch. 2 (mbar)", "Pressure Ch. 3 (mbar)", "Pressure Ch. 4 (mbar)", "Flow Ch. 1 (ul/min)", "Flow Ch. 2 (ul/min)", "Flow Ch. 3 (ul/min)", "Flow Ch. 4 (ul/min)", "measuring time (seconds)", 
-        ]
+        data=data[:n],
+        columns=columns
     )
     return result
 
 def acquireDataCont(ob1elve, savePath, acquisitionRate=10, measureTime=60):
     # Like aquireData but with a continues writing to the savefile, so an error or something does not throw away the data.
-    # WARNING: Sort of implicitly assumes 4 channels
     if type(savePath) == str:
         savePath = pathlib.Path(savePath)
     if savePath.exists():
         raise FileExistsError("File allready exists")
-    columns=[
-        "Unix time (seconds)","Time (seconds)", "Pressure Ch. 1 (mbar)", "Pressure Ch. 2 (mbar)", "Pressure Ch. 3 (mbar)", "Pressure Ch. 4 (mbar)", "Flow Ch. 1 (ul/min)", "Flow Ch. 2 (ul/min)", "Flow Ch. 3 (ul/min)", "Flow Ch. 4 (ul/min)", "measuring time (seconds)", 
-            ]
-    with open(savePath,"w") as f:
+    columns = dataColumns(ob1elve.nChannels)
+    with open(savePath,"w",buffering=64*1024,newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
         # First write headers:
-        f.write("".join([i+"," for i in columns]) + "\n")
+        writer.writerow(columns)
+        # Writing to disk happens in a separate thread, so a slow disk does not mess up the timing of the measurement
+        rows = queue.Queue(maxsize=1024)
+        writerErrors = list()
+        writerFailed = threading.Event()
+        writerThread = threading.Thread(target=_writeRows, args=(rows, f, writer, writerErrors, writerFailed), daemon=True)
+        writerThread.start()
         # and start the measurement
-        p = [False,False,False,False]
-        s = [False,False,False,False]
-        data = list()
-        breakTime = 1/acquisitionRate
-        measurementStart = time.time()
-        measurementEnd = measurementStart + measureTime
-        while True:
-            startTime = time.time()
-            if startTime > measurementEnd:
-                break
-            for i in range(4):
-                try:
-                    p[i] =ob1elve.getPressure(i + 1)
-                except ConnectionError:
-                    # Log it as a NaN, warn the user, and continnue as to not lose data
-                    warnings.warn(f"Pressure in channel {i+1} could not be read at least once.")
-                    p[i] = np.nan
-            for i in range(4):
+        put = rows.put_nowait
+        lastWarn = dict()
+        try:
+            for row in _sampleStream(ob1elve, acquisitionRate, measureTime):
+                if writerFailed.is_set():
+                    break # No use measuring on if it cannot be saved (e.g. disk full)
+                data = row.tolist() # row is reused by _sampleStream, so hand over a copy
                 try:
-                    s[i] =ob1elve.getSensorData(i + 1)
-                except ConnectionError:
-                    # Log it as a NaN, warn the user, and continnue as to not lose data
-                    warnings.warn(f"Flowrate in channel {i+1} could not be read at least once.")
-                    s[i] = np.nan
-            endTime = time.time()
-            delta = endTime - startTime
-            middleTime = startTime + (delta / 2)
-            timeSinceStart = middleTime - measurementStart
-            data = [middleTime,timeSinceStart,*p,*s,delta]
-            f.write( "".join([str(i)+"," for i in data]) + "\n" )
-            # data.append([middleTime,timeSinceStart,*p,*s,delta])
-            if startTime-time.time() < breakTime:
-                time.sleep(breakTime)
-            else:
-                warnings.warn(f"Requested acquisition rate ({acquisitionRate} Hz) could not be reached, working at max possible rate instead (approx. {1 / delta} Hz)")
+                    put(data)
+                except queue.Full:
+                    common.throttledWarn(lastWarn, "queue", "Writing to disk cannot keep up with the measurement, waiting for it to catch up.")
+                    rows.put(data)
+        finally:
+            rows.put(None) # tells writer thread we are done
+            writerThread.join()
+        if writerErrors:
+            raise writerErrors[0]
     print(f"Measurement complete, data is saved to {savePath}.")
+
+def _writeRows(rows, f, writer, errors, failed):
+    """
+    Writer thread of acquireDataCont: write rows from the queue to file f until a None comes in. Exceptions are put in errors, so acquireDataCont can raise them, and the failed Event is set so it knows to stop measuring.
+    """
+    # Buffered, and flushed + synced to disk about every second (see below), so we do not hit the disk for every sample
+    sync = getattr(os, "fdatasync", os.fsync) # no fdatasync on Windows
+    write = writer.writerow
+    get = rows.get
+    now = time.monotonic
+    nextFlush = now() + 1
+    while (data := get()) is not None:
+        if errors:
+            continue # Writing failed earlier, only empty the queue so the measurement does not get stuck
+        try:
+            write(data)
+            if now() >= nextFlush:
+                # At most ~1 second of data is lost if something crashes (also if the whole computer does)
+                f.flush()
+                sync(f.fileno())
+                nextFlush = now() + 1 # not += 1, after a stall that would flush on every row until caught up
+        except Exception as e:
+            errors.append(e)
+            failed.set()
+
+def _sampleStream(ob1elve, acquisitionRate, measureTime):
+    """
+    Read all pressures and flow rates at (approx.) acquisitionRate Hz for measureTime seconds. This is the loop shared by acquireData and acquireDataCont.
+    Yields one row per sample, with the values in dataColumns(). The same numpy array is reused for every row, so store or write it away before the next one.
+    """
+    nc = ob1elve.nChannels
+    row = np.empty(len(dataColumns(nc)))
+    p = row[2:2+nc] # views, so readings go straight into the row
+    s = row[2+nc:2+2*nc]
+    breakTime = 1/acquisitionRate
+    # Local names for everything used in the loop, skips the attribute lookups every sample
+    wallclock = time.time
+    now = time.monotonic
+    sleep = time.sleep
+    clock = time.perf_counter # fine-grained, for the time one sample takes
+    warn = common.throttledWarn
+    lastWarn = dict()
+    isnan = np.isnan
+    flatnonzero = np.flatnonzero
+    getAllPressures = ob1elve.getAllPressures
+    getAllSensorData = ob1elve.getAllSensorData
+    deviceErrors = common.DEVICE_ERRORCODES
+    nan = np.nan
+    measurementStart = wallclock()
+    # Schedule on the monotonic clock, time.time() is only used for the timestamps in the data
+    nextDeadline = now()
+    measurementEnd = nextDeadline + measureTime
+    while True:
+        if now() > measurementEnd:
+            break
+        iterStart = clock()
+        startTime = wallclock()
+        # Channels that could not be read are logged as NaN, so we do not lose the data of the others. Warn the user about them.
+        # Only if the device itself is gone there is no point in continuing.
+        try:
+            p[:] = getAllPressures(missingAsNaN=True)
+        except ConnectionError as e:
+            if abs(e.errno or 0) in deviceErrors:
+                raise
+            p[:] = nan
+            warn(lastWarn, "p", lambda: f"Pressures could not be read at least once ({e}).")
+        else:
+            for i in flatnonzero(isnan(p)):
+                warn(lastWarn, ("p", i), lambda: f"Pressure in channel {i+1} could not be read at least once.")
+        try:
+            s[:] = getAllSensorData(missingAsNaN=True)
+        except ConnectionError as e:
+            if abs(e.errno or 0) in deviceErrors:
+                raise
+            s[:] = nan
+            warn(lastWarn, "s", lambda: f"Flowrates could not be read at least once ({e}).")
+        else:
+            for i in flatnonzero(isnan(s)):
+                warn(lastWarn, ("s", i), lambda: f"Flowrate in channel {i+1} could not be read at least once.")
+        endTime = wallclock()
+        delta = endTime - startTime
+        middleTime = startTime + (delta / 2)
+        row[0] = middleTime
+        row[1] = middleTime - measurementStart
+        row[-1] = delta
+        yield row
+        # Sleep until the next deadline, instead of a fixed time on top of the time reading took
+        nextDeadline += breakTime
+        sleepTime = nextDeadline - now()
+        if sleepTime > 0:
+            sleep(sleepTime)
+        else:
+            warn(lastWarn, "rate", lambda: f"Requested acquisition rate ({acquisitionRate} Hz) could not be reached, working at max possible rate instead (approx. {1 / max(clock() - iterStart, 1e-9):.3g} Hz)")
+            nextDeadline = now() # Start counting again from here, instead of rushing to catch up
\ No newline at end of file